@@ -1,8 +1,13 @@
-import os, io, sqlite3, traceback
+import os, io, sqlite3, atexit, time, traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
 from datetime import datetime
 from flask import Flask, render_template, request, redirect, url_for, flash, session, send_file, send_from_directory
+from werkzeug.exceptions import NotFound
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
+import numpy as np
 import pandas as pd
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
@@ -17,16 +22,73 @@ ALLOWED = {".xlsx", ".csv"}
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = "change-this-in-prod"
+MAX_UPLOAD_MB = 50
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_MB * 1024 * 1024  # larger uploads get a 413
 
 # ---------------- DB helpers ----------------
+# One shared connection: the dev server runs with threaded=False, so every
+# request is served from the same thread. Switch to threading.local before
+# enabling threads.
+_CON = None
+
 def get_db():
-    con = sqlite3.connect(DB_PATH, timeout=30)
-    con.row_factory = sqlite3.Row
-    con.execute("PRAGMA busy_timeout=5000")
-    con.execute("PRAGMA journal_mode=WAL")
-    con.execute("PRAGMA synchronous=NORMAL")
-    con.execute("PRAGMA foreign_keys=ON")
-    return con
+    global _CON
+    if _CON is None:
+        con = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+        con.row_factory = sqlite3.Row
+        con.execute("PRAGMA busy_timeout=5000")
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        con.execute("PRAGMA foreign_keys=ON")
+        con.execute("PRAGMA cache_size=-65536")  # 64 MiB
+        con.execute("PRAGMA temp_store=MEMORY")
+        con.execute("PRAGMA mmap_size=268435456")  # 256 MiB
+        atexit.register(_close_db, con)
+        _CON = con
+    return _CON
+
+def _close_db(con):
+    # refresh planner statistics that drifted since the last ANALYZE
+    con.execute("PRAGMA optimize")
+    con.close()
+
+_FORKED_CON = None
+
+def _worker_init():
+    # Import workers must not use (or close) a SQLite connection inherited
+    # over fork: it is parked untouched and the worker opens its own, which
+    # waits out other imports' write transactions.
+    global _CON, _FORKED_CON
+    _FORKED_CON, _CON = _CON, None
+    get_db().execute("PRAGMA busy_timeout=60000")
+
+@contextmanager
+def transaction(con):
+    # one explicit write transaction (connections run in autocommit mode)
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        yield con
+    except BaseException:
+        con.execute("ROLLBACK")
+        raise
+    con.execute("COMMIT")
+
+@contextmanager
+def bulk_writes(con):
+    # Importers skip fsync while appending to the WAL. Auto-checkpoints are
+    # held off meanwhile, because an unsynced checkpoint writes the main
+    # database file and a power loss could then corrupt it. The checkpoint
+    # runs once synchronous=NORMAL is back, which syncs the WAL before
+    # copying it, so the database file only ever receives synced pages.
+    # An OS crash before that checkpoint can still lose the upload.
+    con.execute("PRAGMA synchronous=OFF")
+    con.execute("PRAGMA wal_autocheckpoint=0")
+    try:
+        yield con
+    finally:
+        con.execute("PRAGMA synchronous=NORMAL")
+        con.execute("PRAGMA wal_autocheckpoint=1000")
+        con.execute("PRAGMA wal_checkpoint(PASSIVE)")
 
 def run_schema():
     with get_db() as con:
@@ -45,7 +107,9 @@ def run_schema():
           upload_type TEXT NOT NULL, -- Students, Attendance, Marks
           row_count INTEGER DEFAULT 0,
           created_at TEXT NOT NULL,
-          uploader_username TEXT NOT NULL
+          uploader_username TEXT NOT NULL,
+          status TEXT NOT NULL DEFAULT 'done', -- processing, done, failed (queued: older rows)
+          error TEXT
         );
 
         CREATE TABLE IF NOT EXISTS students(
@@ -112,6 +176,23 @@ def run_schema():
         cur.execute("PRAGMA table_info(marks)"); mcols=[r[1] for r in cur.fetchall()]
         if "source_upload_id" not in mcols:
             con.execute("ALTER TABLE marks ADD COLUMN source_upload_id INTEGER REFERENCES uploads(id) ON DELETE SET NULL")
+        # background import status
+        cur.execute("PRAGMA table_info(uploads)"); ucols=[r[1] for r in cur.fetchall()]
+        if "status" not in ucols:
+            con.execute("ALTER TABLE uploads ADD COLUMN status TEXT NOT NULL DEFAULT 'done'")
+        if "error" not in ucols:
+            con.execute("ALTER TABLE uploads ADD COLUMN error TEXT")
+        # runs before any job is submitted: in-flight rows belong to a process
+        # that died (kill, crash, power loss) and will never finish
+        con.execute("UPDATE uploads SET status='failed', error='interrupted' WHERE status IN ('queued','processing')")
+        # indexes (after migrations, since they cover provenance columns);
+        # marks/attendance by roll_no are served by their UNIQUE constraints
+        con.executescript("""
+        CREATE INDEX IF NOT EXISTS idx_remarks_roll ON remarks(roll_no, created_at DESC);
+        CREATE INDEX IF NOT EXISTS idx_upload_map_upload ON upload_students_map(upload_id);
+        CREATE INDEX IF NOT EXISTS idx_attendance_source ON attendance(source_upload_id);
+        CREATE INDEX IF NOT EXISTS idx_marks_source ON marks(source_upload_id);
+        """)
         con.commit()
 
 def ensure_admin():
@@ -123,264 +204,352 @@ def ensure_admin():
             con.commit()
 
 # --------------- Utils ---------------
-def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.rename(columns=lambda c: str(c).strip().lower())
-    aliases = {
-        "roll":"roll_no","roll no":"roll_no","rollno":"roll_no","rollnumber":"roll_no","roll_no.":"roll_no",
-        "student name":"name","student":"name","name of student":"name",
-        "student email":"email","mail":"email","e-mail":"email",
-        "student phone number":"phone","phone number":"phone","mobile":"phone","student phone":"phone","contact":"phone",
-        "father name":"father_name","father's name":"father_name","guardian name":"father_name",
-        "father phone number":"father_phone","father mobile":"father_phone","guardian phone":"father_phone",
-        "sem":"semester","sub":"subject","subject name":"subject",
-        "max":"max_marks","maxmarks":"max_marks","marks":"marks_obtained","obtained":"marks_obtained"
-    }
-    for k, v in aliases.items():
-        if k in df.columns and v not in df.columns:
-            df[v] = df.pop(k)
-    return df
+_ALIASES = {
+    "roll":"roll_no","roll no":"roll_no","rollno":"roll_no","rollnumber":"roll_no","roll_no.":"roll_no",
+    "student name":"name","student":"name","name of student":"name",
+    "student email":"email","mail":"email","e-mail":"email",
+    "student phone number":"phone","phone number":"phone","mobile":"phone","student phone":"phone","contact":"phone",
+    "father name":"father_name","father's name":"father_name","guardian name":"father_name",
+    "father phone number":"father_phone","father mobile":"father_phone","guardian phone":"father_phone",
+    "sem":"semester","sub":"subject","subject name":"subject",
+    "max":"max_marks","maxmarks":"max_marks","marks":"marks_obtained","obtained":"marks_obtained"
+}
+
+# Columns each import reads (required + optional), also shown on the admin page
+STUDENT_COLS = ["roll_no","name","email","phone","father_name","father_phone","semester"]
+ATTENDANCE_COLS = ["roll_no","subject","attended","total","semester"]
+MARKS_COLS = ["roll_no","exam","subject","max_marks","marks_obtained","credits","semester"]
+_STUDENT_REQUIRED = frozenset(STUDENT_COLS)
+_ATTENDANCE_REQUIRED = frozenset(["roll_no","subject","attended","total"])
+_MARKS_REQUIRED = frozenset(["roll_no","exam","subject","max_marks","marks_obtained"])
+_STUDENT_TEXT_COLS = ["roll_no","name","email","phone","father_name","father_phone"]
+_STUDENT_NULLABLE_COLS = ["email","phone","father_name","father_phone"]
+
+def canonical_column(name) -> str:
+    name = str(name).strip().lower()
+    return _ALIASES.get(name, name)
 
-def load_table(path: str) -> pd.DataFrame:
+def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
+    cols = [str(c).strip().lower() for c in df.columns]
+    # an alias is only applied when its target is not already present (the
+    # first matching column wins), so renaming never produces duplicates
+    taken = set(cols)
+    mapping = {}
+    for c in cols:
+        v = _ALIASES.get(c)
+        if v and v not in taken:
+            taken.add(v)
+            mapping[c] = v
+    return df.set_axis([mapping.get(c, c) for c in cols], axis=1)
+
+def load_table(path: str, columns=None) -> pd.DataFrame:
+    # Cells are read as text (importers parse numbers themselves); with
+    # `columns`, only headers that normalize to one of them are parsed.
     ext = os.path.splitext(path)[1].lower()
     if ext == ".xlsx":
-        return pd.read_excel(path, sheet_name=0)
+        usecols = (lambda c: canonical_column(c) in columns) if columns else None
+        return pd.read_excel(path, sheet_name=0, engine="openpyxl", dtype=str, usecols=usecols)
     if ext == ".csv":
-        return pd.read_csv(path)
+        usecols = None
+        if columns:
+            header = pd.read_csv(path, nrows=0).columns
+            usecols = [c for c in header if canonical_column(c) in columns]
+        # C engine: dtype=str keeps cells verbatim (leading zeros, blanks as
+        # NA); the pyarrow engine infers types first and casts afterwards
+        return pd.read_csv(path, dtype=str, usecols=usecols)
     raise ValueError("Only .xlsx or .csv supported.")
 
 def save_upload(fs):
     ext = os.path.splitext(fs.filename)[1].lower()
     if ext not in {".xlsx", ".csv"}:
         raise ValueError("Only .xlsx or .csv allowed.")
-    name = f"{int(pd.Timestamp.now().timestamp()*1000)}_{secure_filename(fs.filename)}"
+    name = f"{time.time_ns()//1_000_000}_{secure_filename(fs.filename)}"
     full = os.path.join(UPLOAD_DIR, name)
-    fs.save(full)
+    fs.save(full, buffer_size=1 << 20)
     return full, name
 
-def create_upload_record(filename: str, upload_type: str) -> int:
-    with get_db() as con:
-        cur = con.cursor()
-        cur.execute(
-            "INSERT INTO uploads(filename, upload_type, row_count, created_at, uploader_username) VALUES(?,?,?,?,?)",
-            (filename, upload_type, 0, datetime.now().isoformat(timespec='seconds'), session.get("username", "admin")),
-        )
-        con.commit()
-        return cur.lastrowid
+def create_upload_record(con, filename: str, upload_type: str, uploader: str, created_at: str,
+                         status: str = "processing", error=None) -> int:
+    cur = con.execute(
+        "INSERT INTO uploads(filename, upload_type, row_count, created_at, uploader_username, status, error) VALUES(?,?,?,?,?,?,?)",
+        (filename, upload_type, 0, created_at, uploader, status, error),
+    )
+    return cur.lastrowid
 
-def bump_rowcount(upload_id: int, n: int):
-    with get_db() as con:
-        con.execute("UPDATE uploads SET row_count=row_count+? WHERE id=?", (n, upload_id))
-        con.commit()
+def bump_rowcount(con, upload_id: int, n: int):
+    con.execute("UPDATE uploads SET row_count=row_count+? WHERE id=?", (n, upload_id))
 
 # --------------- Importers (with provenance) ---------------
+def _check_columns(df: pd.DataFrame, required: frozenset, kind: str):
+    missing = required - set(df.columns)
+    if missing:
+        raise ValueError(f"{kind}: missing column(s) " + ", ".join(f"'{c}'" for c in sorted(missing)))
+
+def _str_column(df: pd.DataFrame, col: str) -> pd.Series:
+    return df[col].astype("string").str.strip()
+
+def _int_column(df: pd.DataFrame, col: str, default=None) -> pd.Series:
+    # int(float(x)) semantics, vectorized; unparsable cells (or an absent
+    # optional column) become `default`
+    if col in df.columns:
+        n = pd.to_numeric(df[col].astype(str).str.strip(), errors="coerce")
+    else:
+        n = pd.Series(np.nan, index=df.index)
+    n = np.trunc(n.where(np.isfinite(n))).astype("Int64")
+    return n if default is None else n.fillna(default)
+
+def _db_rows(df: pd.DataFrame) -> list:
+    # executemany-ready tuples; pandas NA becomes None (SQL NULL)
+    return list(df.astype(object).where(df.notna(), None).itertuples(index=False, name=None))
+
+def _existing_rolls(cur, rolls) -> set:
+    # incoming rolls go into a temp table and are intersected with students
+    # inside SQLite, instead of probing students once per row
+    cur.execute("CREATE TEMP TABLE IF NOT EXISTS _incoming_rolls(r TEXT PRIMARY KEY)")
+    cur.execute("DELETE FROM _incoming_rolls")
+    cur.executemany("INSERT OR IGNORE INTO _incoming_rolls(r) VALUES(?)", ((r,) for r in rolls))
+    return {r[0] for r in cur.execute(
+        "SELECT r FROM _incoming_rolls WHERE r IN (SELECT roll_no FROM students)"
+    )}
+
 def import_students(df: pd.DataFrame, upload_id: int):
     df = normalize_columns(df).fillna("")
-    required = ["roll_no","name","email","phone","father_name","father_phone","semester"]
-    for col in required:
-        if col not in df.columns:
-            raise ValueError(f"Students: missing column '{col}'")
-    n = 0
-    with get_db() as con:
+    _check_columns(df, _STUDENT_REQUIRED, "Students")
+    out = pd.DataFrame({col: _str_column(df, col) for col in _STUDENT_TEXT_COLS})
+    for col in _STUDENT_NULLABLE_COLS:
+        out[col] = out[col].mask(out[col].str.len() == 0)
+    out["semester"] = _int_column(df, "semester")
+    out = out[out["roll_no"].str.len() > 0]
+    rows = _db_rows(out)
+    with get_db() as con, bulk_writes(con), transaction(con):
         cur = con.cursor()
-        for _, r in df.iterrows():
-            roll = str(r["roll_no"]).strip()
-            if not roll: 
-                continue
-            name = str(r["name"]).strip()
-            email = str(r["email"]).strip() or None
-            phone = str(r["phone"]).strip() or None
-            fname = str(r["father_name"]).strip() or None
-            fphone = str(r["father_phone"]).strip() or None
-            # semester
-            semester = None
-            sr = str(r["semester"]).strip()
-            if sr and sr.lower() != "nan":
-                try: semester = int(float(sr))
-                except: semester = None
-            existed = cur.execute("SELECT 1 FROM students WHERE roll_no=?", (roll,)).fetchone()
-            cur.execute(
-                """INSERT INTO students(roll_no,name,email,phone,father_name,father_phone,semester)
-                   VALUES(?,?,?,?,?,?,?)
-                   ON CONFLICT(roll_no) DO UPDATE SET
-                     name=excluded.name,
-                     email=excluded.email,
-                     phone=excluded.phone,
-                     father_name=excluded.father_name,
-                     father_phone=excluded.father_phone,
-                     semester=excluded.semester""",
-                (roll, name, email, phone, fname, fphone, semester),
-            )
-            cur.execute(
-                "INSERT INTO upload_students_map(upload_id, roll_no, created_new) VALUES(?,?,?)",
-                (upload_id, roll, 0 if existed else 1),
-            )
-            n += 1
-        con.commit()
-    bump_rowcount(upload_id, n)
+        existing = _existing_rolls(cur, out["roll_no"])
+        cur.executemany(
+            """INSERT INTO students(roll_no,name,email,phone,father_name,father_phone,semester)
+               VALUES(?,?,?,?,?,?,?)
+               ON CONFLICT(roll_no) DO UPDATE SET
+                 name=excluded.name,
+                 email=excluded.email,
+                 phone=excluded.phone,
+                 father_name=excluded.father_name,
+                 father_phone=excluded.father_phone,
+                 semester=excluded.semester""",
+            rows,
+        )
+        # a roll repeated within one file is only "created" by its first row
+        mapped = []
+        for roll in out["roll_no"]:
+            mapped.append((upload_id, roll, 0 if roll in existing else 1))
+            existing.add(roll)
+        cur.executemany(
+            "INSERT INTO upload_students_map(upload_id, roll_no, created_new) VALUES(?,?,?)", mapped
+        )
+        bump_rowcount(con, upload_id, len(rows))
+        con.execute("ANALYZE students")
+        con.execute("ANALYZE upload_students_map")
 
 def import_attendance(df: pd.DataFrame, upload_id: int):
     df = normalize_columns(df).fillna(0)
-    for col in ["roll_no", "subject", "attended", "total"]:
-        if col not in df.columns:
-            raise ValueError(f"Attendance: missing column '{col}'")
-    n = 0
-    with get_db() as con:
-        cur = con.cursor()
-        for _, r in df.iterrows():
-            roll = str(r["roll_no"]).strip()
-            subj = str(r["subject"]).strip()
-            if not roll or not subj:
-                continue
-            attended = int(float(r["attended"])) if str(r["attended"]).strip() else 0
-            total = int(float(r["total"])) if str(r["total"]).strip() else 0
-            semester = None
-            if "semester" in df.columns:
-                sr = str(r["semester"]).strip()
-                if sr and sr.lower() != "nan":
-                    try: semester = int(float(sr))
-                    except: semester = None
-            cur.execute(
-                """INSERT INTO attendance(roll_no,subject,attended,total,semester,source_upload_id)
-                   VALUES(?,?,?,?,?,?)
-                   ON CONFLICT(roll_no,subject) DO UPDATE SET
-                     attended=excluded.attended,
-                     total=excluded.total,
-                     semester=COALESCE(excluded.semester, attendance.semester),
-                     source_upload_id=excluded.source_upload_id""",
-                (roll, subj, attended, total, semester, upload_id),
-            )
-            n += 1
-        con.commit()
-    bump_rowcount(upload_id, n)
+    _check_columns(df, _ATTENDANCE_REQUIRED, "Attendance")
+    out = pd.DataFrame({
+        "roll_no": _str_column(df, "roll_no"),
+        "subject": _str_column(df, "subject"),
+        "attended": _int_column(df, "attended", 0),
+        "total": _int_column(df, "total", 0),
+        "semester": _int_column(df, "semester"),
+        "source_upload_id": upload_id,
+    })
+    out = out[(out["roll_no"].str.len() > 0) & (out["subject"].str.len() > 0)]
+    rows = _db_rows(out)
+    with get_db() as con, bulk_writes(con), transaction(con):
+        con.executemany(
+            """INSERT INTO attendance(roll_no,subject,attended,total,semester,source_upload_id)
+               VALUES(?,?,?,?,?,?)
+               ON CONFLICT(roll_no,subject) DO UPDATE SET
+                 attended=excluded.attended,
+                 total=excluded.total,
+                 semester=COALESCE(excluded.semester, attendance.semester),
+                 source_upload_id=excluded.source_upload_id""",
+            rows,
+        )
+        bump_rowcount(con, upload_id, len(rows))
+        con.execute("ANALYZE attendance")
 
 def import_marks(df: pd.DataFrame, upload_id: int):
     df = normalize_columns(df).fillna(0)
-    for col in ["roll_no", "exam", "subject", "max_marks", "marks_obtained"]:
-        if col not in df.columns:
-            raise ValueError(f"Marks: missing column '{col}'")
-    n = 0
-    with get_db() as con:
-        cur = con.cursor()
-        for _, r in df.iterrows():
-            roll = str(r["roll_no"]).strip()
-            exam = str(r["exam"]).strip()
-            subj = str(r["subject"]).strip()
-            if not roll or not exam or not subj:
-                continue
-            maxm = int(float(r["max_marks"])) if str(r["max_marks"]).strip() else 0
-            got = int(float(r["marks_obtained"])) if str(r["marks_obtained"]).strip() else 0
-            credits = None
-            if "credits" in df.columns:
-                cr = str(r["credits"]).strip()
-                if cr and cr.lower() != "nan":
-                    try: credits = int(float(cr))
-                    except: credits = None
-            semester = None
-            if "semester" in df.columns:
-                sr = str(r["semester"]).strip()
-                if sr and sr.lower() != "nan":
-                    try: semester = int(float(sr))
-                    except: semester = None
-            cur.execute(
-                """INSERT INTO marks(roll_no,exam,subject,max_marks,marks_obtained,credits,semester,source_upload_id)
-                   VALUES(?,?,?,?,?,?,?,?)
-                   ON CONFLICT(roll_no,exam,subject) DO UPDATE SET
-                     max_marks=excluded.max_marks,
-                     marks_obtained=excluded.marks_obtained,
-                     credits=COALESCE(excluded.credits, marks.credits),
-                     semester=COALESCE(excluded.semester, marks.semester),
-                     source_upload_id=excluded.source_upload_id""",
-                (roll, exam, subj, maxm, got, credits, semester, upload_id),
+    _check_columns(df, _MARKS_REQUIRED, "Marks")
+    out = pd.DataFrame({
+        "roll_no": _str_column(df, "roll_no"),
+        "exam": _str_column(df, "exam"),
+        "subject": _str_column(df, "subject"),
+        "max_marks": _int_column(df, "max_marks", 0),
+        "marks_obtained": _int_column(df, "marks_obtained", 0),
+        "credits": _int_column(df, "credits"),
+        "semester": _int_column(df, "semester"),
+        "source_upload_id": upload_id,
+    })
+    out = out[(out["roll_no"].str.len() > 0) & (out["exam"].str.len() > 0) & (out["subject"].str.len() > 0)]
+    rows = _db_rows(out)
+    with get_db() as con, bulk_writes(con), transaction(con):
+        con.executemany(
+            """INSERT INTO marks(roll_no,exam,subject,max_marks,marks_obtained,credits,semester,source_upload_id)
+               VALUES(?,?,?,?,?,?,?,?)
+               ON CONFLICT(roll_no,exam,subject) DO UPDATE SET
+                 max_marks=excluded.max_marks,
+                 marks_obtained=excluded.marks_obtained,
+                 credits=COALESCE(excluded.credits, marks.credits),
+                 semester=COALESCE(excluded.semester, marks.semester),
+                 source_upload_id=excluded.source_upload_id""",
+            rows,
+        )
+        bump_rowcount(con, upload_id, len(rows))
+        con.execute("ANALYZE marks")
+
+IMPORTERS = {
+    "Students": (STUDENT_COLS, import_students),
+    "Attendance": (ATTENDANCE_COLS, import_attendance),
+    "Marks": (MARKS_COLS, import_marks),
+}
+
+def import_job(path: str, name: str, kind: str, uploader: str, created_at: str):
+    # Runs in an EXECUTOR worker. The upload row is written here rather than
+    # by the web process, so queueing an upload never waits on the write lock
+    # an earlier import holds; the outcome is shown under Recent Uploads.
+    cols, importer = IMPORTERS[kind]
+    con = get_db()
+    upload_id = create_upload_record(con, name, kind, uploader, created_at)
+    try:
+        importer(load_table(path, cols), upload_id)
+    except Exception as e:
+        traceback.print_exc()
+        con.execute("UPDATE uploads SET status='failed', error=? WHERE id=?", (str(e), upload_id))
+    else:
+        con.execute("UPDATE uploads SET status='done' WHERE id=?", (upload_id,))
+
+# Parsing + importing runs off the (single-threaded) web process. One
+# worker: SQLite has a single writer anyway, and uploads must apply in the
+# order they were submitted (e.g. attendance for students still importing).
+EXECUTOR = ProcessPoolExecutor(max_workers=1, initializer=_worker_init)
+
+# Upload statuses an import job still owns; such uploads cannot be deleted
+IN_FLIGHT = ("queued", "processing")
+
+def _import_finished(fut, name: str, kind: str, uploader: str, created_at: str):
+    # import_job records its own outcome; this covers jobs that never got to
+    # (worker died, job cancelled), whether or not the upload row had been
+    # written yet. Runs on the executor's thread, so it opens its own
+    # connection instead of the shared one.
+    if not fut.cancelled() and fut.exception() is None:
+        return
+    err = "cancelled" if fut.cancelled() else (str(fut.exception()) or type(fut.exception()).__name__)
+    con = sqlite3.connect(DB_PATH, timeout=30)
+    try:
+        with con:
+            cur = con.execute(
+                "UPDATE uploads SET status='failed', error=? WHERE filename=? AND status IN ('queued','processing')",
+                (err, name),
             )
-            n += 1
-        con.commit()
-    bump_rowcount(upload_id, n)
+            if not cur.rowcount and not con.execute("SELECT 1 FROM uploads WHERE filename=?", (name,)).fetchone():
+                create_upload_record(con, name, kind, uploader, created_at, status="failed", error=err)
+    finally:
+        con.close()
+
+def queue_import(path: str, name: str, kind: str):
+    # No database write here: the worker records the upload when it starts
+    global EXECUTOR
+    job = (name, kind, session.get("username", "admin"), datetime.now().isoformat(timespec='seconds'))
+    try:
+        fut = EXECUTOR.submit(import_job, path, *job)
+    except BrokenProcessPool:
+        # a worker died earlier; start a fresh pool for this and later jobs
+        EXECUTOR = ProcessPoolExecutor(max_workers=1, initializer=_worker_init)
+        fut = EXECUTOR.submit(import_job, path, *job)
+    fut.add_done_callback(lambda f: _import_finished(f, *job))
 
 def delete_upload(upload_id: int) -> bool:
-    with get_db() as con:
+    with get_db() as con, transaction(con):
         cur = con.cursor()
         up = cur.execute("SELECT * FROM uploads WHERE id=?", (upload_id,)).fetchone()
         if not up:
             return False
         cur.execute("DELETE FROM attendance WHERE source_upload_id=?", (upload_id,))
         cur.execute("DELETE FROM marks WHERE source_upload_id=?", (upload_id,))
-        created = cur.execute(
-            "SELECT roll_no FROM upload_students_map WHERE upload_id=? AND created_new=1", (upload_id,)
-        ).fetchall()
-        if created:
-            rolls = [r["roll_no"] for r in created]
-            q = f"DELETE FROM students WHERE roll_no IN ({','.join('?'*len(rolls))})"
-            cur.execute(q, rolls)
+        cur.execute(
+            """DELETE FROM students WHERE roll_no IN (
+                 SELECT roll_no FROM upload_students_map WHERE upload_id=? AND created_new=1)""",
+            (upload_id,),
+        )
         cur.execute("DELETE FROM upload_students_map WHERE upload_id=?", (upload_id,))
         cur.execute("DELETE FROM uploads WHERE id=?", (upload_id,))
-        con.commit()
     return True
 
 # --------------- Wide views ---------------
-def letter_grade(pct: float) -> str:
-    if pct >= 85: return "A+"
-    if pct >= 75: return "A"
-    if pct >= 65: return "B+"
-    if pct >= 55: return "B"
-    if pct >= 45: return "C"
-    if pct >= 35: return "D"
-    return "F"
+# Letter grade per mark, evaluated inside SQLite so the grid is built from
+# ready-made cell strings.
+MARKS_GRID_SQL = """
+    SELECT exam, subject,
+           CASE
+             WHEN pct >= 85 THEN 'A+'
+             WHEN pct >= 75 THEN 'A'
+             WHEN pct >= 65 THEN 'B+'
+             WHEN pct >= 55 THEN 'B'
+             WHEN pct >= 45 THEN 'C'
+             WHEN pct >= 35 THEN 'D'
+             ELSE 'F'
+           END || ' (' || marks_obtained || '/' || max_marks || ')' AS cell
+    FROM (SELECT exam, subject, marks_obtained, max_marks,
+                 CASE WHEN max_marks THEN 100.0 * marks_obtained / max_marks ELSE 0.0 END AS pct
+          FROM marks WHERE roll_no=?)
+"""
 
 def build_marks_grid(roll: str):
-    with get_db() as con:
-        rows = con.execute(
-            "SELECT exam, subject, max_marks, marks_obtained FROM marks WHERE roll_no=? ORDER BY exam, subject", (roll,)
-        ).fetchall()
-    if not rows: 
+    df = pd.read_sql_query(MARKS_GRID_SQL, get_db(), params=(roll,))
+    if df.empty:
         return [], []
-    subjects = sorted({r["subject"] for r in rows})
-    exams = []
-    for r in rows:
-        if r["exam"] not in exams:
-            exams.append(r["exam"])
-    grid_rows = []
-    for ex in exams:
-        row = {"Exam": ex}
-        for sub in subjects:
-            match = [r for r in rows if r["exam"]==ex and r["subject"]==sub]
-            if match:
-                r = match[0]
-                pct = (100.0 * r["marks_obtained"] / r["max_marks"]) if r["max_marks"] else 0.0
-                row[sub] = f"{letter_grade(pct)} ({r['marks_obtained']}/{r['max_marks']})"
-            else:
-                row[sub] = "—"
-        grid_rows.append(row)
-    headers = ["Exam"] + subjects
-    return headers, grid_rows
+    grid = df.pivot_table(index="exam", columns="subject", values="cell", aggfunc="first").fillna("—")
+    headers = ["Exam"] + list(grid.columns)
+    return headers, grid.reset_index().rename(columns={"exam": "Exam"}).to_dict("records")
 
 def build_attendance_grid(roll: str):
-    with get_db() as con:
-        rows = con.execute(
-            "SELECT subject, attended, total FROM attendance WHERE roll_no=? ORDER BY subject", (roll,)
-        ).fetchall()
-    if not rows: 
+    df = pd.read_sql_query(
+        "SELECT subject, attended, total FROM attendance WHERE roll_no=?", get_db(), params=(roll,)
+    )
+    if df.empty:
         return [], []
-    subjects = [r["subject"] for r in rows]
-    row = {"Row": "Attendance"}
-    for r in rows:
-        pct = (100.0 * r["attended"] / r["total"]) if r["total"] else 0.0
-        row[r["subject"]] = f"{r['attended']}/{r['total']} ({pct:.0f}%)"
-    headers = ["Row"] + subjects
-    return headers, [row]
+    pct = (100.0 * df["attended"] / df["total"]).where(df["total"] != 0, 0.0)
+    df["cell"] = (df["attended"].astype(str) + "/" + df["total"].astype(str)
+                  + " (" + pct.round().astype(int).astype(str) + "%)")
+    df["Row"] = "Attendance"
+    grid = df.pivot_table(index="Row", columns="subject", values="cell", aggfunc="first")
+    headers = ["Row"] + list(grid.columns)
+    return headers, grid.reset_index().to_dict("records")
 
 # --------------- Routes ---------------
+# Shown when a web-process write times out on the lock held by an import
+DB_BUSY_MSG = 'An import is writing to the database right now; please retry in a moment.'
+
+def _is_locked(e: sqlite3.OperationalError) -> bool:
+    # "database is locked" / "database table is locked"; other operational
+    # errors (disk I/O, disk full, schema) are real failures
+    return 'locked' in str(e)
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    flash(f'File too large (max {MAX_UPLOAD_MB} MB).','error')
+    return redirect(url_for('admin_imports'))
+
 @app.route('/')
 def home():
     return render_template('index.html')
 
 @app.route('/templates/<kind>')
 def download_template(kind):
-    filename = kind
-    path = os.path.join(TEMPLATE_DIR, filename)
-    if not os.path.exists(path):
+    # conditional=True answers repeat downloads with 304 via ETag/Last-Modified
+    try:
+        return send_from_directory(TEMPLATE_DIR, kind, as_attachment=True, conditional=True, max_age=3600)
+    except NotFound:
         flash('Template not found','error')
         return redirect(url_for('home'))
-    return send_from_directory(TEMPLATE_DIR, filename, as_attachment=True)
 
 @app.route('/search')
 def search():
@@ -391,12 +560,12 @@ def search():
 
 @app.route('/student/<roll_no>')
 def student_view(roll_no):
-    with get_db() as con:
-        cur=con.cursor()
-        s=cur.execute('SELECT * FROM students WHERE roll_no=?',(roll_no,)).fetchone()
-        if not s:
-            flash('Student not found.','error'); return redirect(url_for('home'))
-        remarks=cur.execute('SELECT * FROM remarks WHERE roll_no=? ORDER BY created_at DESC',(roll_no,)).fetchall()
+    con = get_db()
+    cur=con.cursor()
+    s=cur.execute('SELECT * FROM students WHERE roll_no=?',(roll_no,)).fetchone()
+    if not s:
+        flash('Student not found.','error'); return redirect(url_for('home'))
+    remarks=cur.execute('SELECT * FROM remarks WHERE roll_no=? ORDER BY created_at DESC',(roll_no,)).fetchall()
     marks_headers, marks_rows = build_marks_grid(roll_no)
     att_headers, att_rows = build_attendance_grid(roll_no)
     # simple % and cgpa
@@ -413,23 +582,45 @@ def add_remark(roll_no):
     text=(request.form.get('remark') or '').strip()
     if not text:
         flash('Remark cannot be empty.','error'); return redirect(url_for('student_view', roll_no=roll_no))
-    with get_db() as con:
-        con.execute('INSERT INTO remarks(roll_no,remark_text,author_username,created_at) VALUES(?,?,?,?)',
-                    (roll_no, text, session.get('username','admin'), datetime.now().isoformat(timespec='seconds')))
-        con.commit()
+    try:
+        with get_db() as con:
+            con.execute('INSERT INTO remarks(roll_no,remark_text,author_username,created_at) VALUES(?,?,?,?)',
+                        (roll_no, text, session.get('username','admin'), datetime.now().isoformat(timespec='seconds')))
+            con.commit()
+    except sqlite3.OperationalError as e:
+        if not _is_locked(e): raise
+        traceback.print_exc(); flash(DB_BUSY_MSG,'error'); return redirect(url_for('student_view', roll_no=roll_no))
     flash('Remark added.','success'); return redirect(url_for('student_view', roll_no=roll_no))
 
 # --- Admin auth ---
+# Password checks are deliberately slow (pbkdf2), so a client that keeps
+# failing is refused before any hashing is done.
+LOGIN_MAX_FAILURES = 5
+LOGIN_WINDOW_SECONDS = 300
+_login_failures = {}  # client ip -> monotonic times of recent failures
+
 @app.route('/admin/login', methods=['GET','POST'])
 def admin_login():
     if request.method=='POST':
+        ip = request.remote_addr or ''
+        now = time.monotonic()
+        # forget clients whose newest failure has aged out of the window
+        for k in [k for k, ts in _login_failures.items() if now - ts[-1] >= LOGIN_WINDOW_SECONDS]:
+            del _login_failures[k]
+        failures = [t for t in _login_failures.get(ip, []) if now - t < LOGIN_WINDOW_SECONDS]
+        if len(failures) >= LOGIN_MAX_FAILURES:
+            flash('Too many failed attempts. Try again in a few minutes.','error')
+            return render_template('admin_login.html'), 429
         u=(request.form.get('username') or '').strip()
         p=(request.form.get('password') or '')
-        with get_db() as con:
-            row=con.execute('SELECT * FROM users WHERE username=?',(u,)).fetchone()
+        con = get_db()
+        row=con.execute('SELECT * FROM users WHERE username=?',(u,)).fetchone()
         if row and check_password_hash(row['password'], p) and row['role']=='admin':
+            _login_failures.pop(ip, None)
             session['username']=u; session['role']='admin'
             flash('Welcome, Admin!','success'); return redirect(url_for('admin_imports'))
+        failures.append(now)
+        _login_failures[ip] = failures
         flash('Invalid credentials','error')
     return render_template('admin_login.html')
 
@@ -441,18 +632,15 @@ def admin_logout():
 @app.route('/admin/imports')
 def admin_imports():
     if session.get('role')!='admin': return redirect(url_for('admin_login'))
-    with get_db() as con:
-        stats = {
-            'students': con.execute('SELECT COUNT(*) FROM students').fetchone()[0],
-            'attendance': con.execute('SELECT COUNT(*) FROM attendance').fetchone()[0],
-            'marks': con.execute('SELECT COUNT(*) FROM marks').fetchone()[0],
-        }
-        recent = con.execute('SELECT * FROM uploads ORDER BY id DESC LIMIT 50').fetchall()
-    student_cols = ["roll_no","name","email","phone","father_name","father_phone","semester"]
-    attendance_cols = ["roll_no","subject","attended","total","semester"]
-    marks_cols = ["roll_no","exam","subject","max_marks","marks_obtained","credits","semester"]
+    con = get_db()
+    stats = {
+        'students': con.execute('SELECT COUNT(*) FROM students').fetchone()[0],
+        'attendance': con.execute('SELECT COUNT(*) FROM attendance').fetchone()[0],
+        'marks': con.execute('SELECT COUNT(*) FROM marks').fetchone()[0],
+    }
+    recent = con.execute('SELECT * FROM uploads ORDER BY id DESC LIMIT 50').fetchall()
     return render_template('admin_imports.html', stats=stats, uploads=recent,
-                           student_cols=student_cols, attendance_cols=attendance_cols, marks_cols=marks_cols)
+                           student_cols=STUDENT_COLS, attendance_cols=ATTENDANCE_COLS, marks_cols=MARKS_COLS)
 
 @app.route('/admin/upload/students', methods=['POST'])
 def upload_students():
@@ -462,10 +650,8 @@ def upload_students():
         flash('Choose a Students Excel/CSV file.','error'); return redirect(url_for('admin_imports'))
     try:
         path, name = save_upload(f)
-        up_id = create_upload_record(name, 'Students')
-        df = load_table(path)
-        import_students(df, up_id)
-        flash('Students imported/updated successfully.','success')
+        queue_import(path, name, 'Students')
+        flash('Students file queued for import; it appears under Recent Uploads once processing starts.','success')
     except Exception as e:
         traceback.print_exc(); flash(f'Import failed (Students): {e}','error')
     return redirect(url_for('admin_imports'))
@@ -478,10 +664,8 @@ def upload_attendance():
         flash('Choose an Attendance Excel/CSV file.','error'); return redirect(url_for('admin_imports'))
     try:
         path, name = save_upload(f)
-        up_id = create_upload_record(name, 'Attendance')
-        df = load_table(path)
-        import_attendance(df, up_id)
-        flash('Attendance imported/updated successfully.','success')
+        queue_import(path, name, 'Attendance')
+        flash('Attendance file queued for import; it appears under Recent Uploads once processing starts.','success')
     except Exception as e:
         traceback.print_exc(); flash(f'Import failed (Attendance): {e}','error')
     return redirect(url_for('admin_imports'))
@@ -494,10 +678,8 @@ def upload_marks():
         flash('Choose a Marks Excel/CSV file.','error'); return redirect(url_for('admin_imports'))
     try:
         path, name = save_upload(f)
-        up_id = create_upload_record(name, 'Marks')
-        df = load_table(path)
-        import_marks(df, up_id)
-        flash('Marks imported/updated successfully.','success')
+        queue_import(path, name, 'Marks')
+        flash('Marks file queued for import; it appears under Recent Uploads once processing starts.','success')
     except Exception as e:
         traceback.print_exc(); flash(f'Import failed (Marks): {e}','error')
     return redirect(url_for('admin_imports'))
@@ -505,7 +687,15 @@ def upload_marks():
 @app.route('/admin/uploads/<int:upload_id>/delete', methods=['POST'])
 def delete_upload_route(upload_id):
     if session.get('role')!='admin': return redirect(url_for('admin_login'))
-    ok = delete_upload(upload_id)
+    up = get_db().execute('SELECT status FROM uploads WHERE id=?', (upload_id,)).fetchone()
+    if up and up['status'] in IN_FLIGHT:
+        flash(f'Upload #{upload_id} is still being imported; delete it once it has finished.','error')
+        return redirect(url_for('admin_imports'))
+    try:
+        ok = delete_upload(upload_id)
+    except sqlite3.OperationalError as e:
+        if not _is_locked(e): raise
+        traceback.print_exc(); flash(DB_BUSY_MSG,'error'); return redirect(url_for('admin_imports'))
     flash('Upload deleted and data rolled back.' if ok else 'Upload not found.',
          'success' if ok else 'error')
     return redirect(url_for('admin_imports'))
@@ -518,7 +708,7 @@ def student_pdf(roll):
     c = canvas.Canvas(buf, pagesize=A4)
     c.drawString(100, 800, f"Student Report: {roll}")
     c.showPage(); c.save(); buf.seek(0)
-    return send_file(buf, as_attachment=True, download_name=f'{roll}_report.pdf')
+    return send_file(buf, mimetype='application/pdf', as_attachment=True, download_name=f'{roll}_report.pdf')
 
 # --------------- Entry ---------------
 if __name__ == '__main__':